@@ -1,22 +1,66 @@
 import asyncio
+import ctranslate2
+import functools
+import multiprocessing
+import importlib.util
+import logging
 import websockets
 import numpy as np
-import soundfile as sf
 from faster_whisper import WhisperModel
-from openai import OpenAI
+from openai import AsyncOpenAI, DefaultAsyncHttpxClient
 import os
+import re
+import struct
 import subprocess
+import time
 import tempfile
 import wave
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+
+try:
+    from numba import njit, prange
+except ImportError:
+    njit = None
+
+try:
+    from piper import PiperVoice
+except ImportError:
+    PiperVoice = None
+
+# Progress logs are DEBUG; set LOG_LEVEL=DEBUG to see per-chunk send/receive progress
+logging.basicConfig(level=os.environ.get("LOG_LEVEL", "INFO").upper(), format="%(message)s")
+logger = logging.getLogger("voice")
 
 PORT = 8765
+DEBUG = os.environ.get("DEBUG", "").lower() not in ("", "0", "false", "no")  # save response.wav copies of each TTS reply
 SAMPLE_RATE = 22050  # TTS output sample rate
 
-# STT (local)
-whisper = WhisperModel("base", device="cpu", compute_type="int8")
-
-# AI (cloud)
-client = OpenAI(api_key=os.environ.get("OPENAI_API_KEY"))
+# STT (local) - int8 weights everywhere; on a CUDA GPU run the larger distilled
+# model with float16 activations, otherwise the small English one on CPU.
+# Each of STT_PROCESSES worker processes loads its own model (see init_stt_process),
+# so utterances from different clients transcribe in parallel without sharing the GIL.
+# On CUDA a single process keeps one copy of the large model on the GPU.
+if ctranslate2.get_cuda_device_count() > 0:
+    WHISPER_MODEL, WHISPER_DEVICE, WHISPER_COMPUTE = "distil-large-v3", "cuda", "int8_float16"
+    STT_PROCESSES = 1
+else:
+    WHISPER_MODEL, WHISPER_DEVICE, WHISPER_COMPUTE = "distil-small.en", "cpu", "int8"
+    STT_PROCESSES = 2
+whisper = None  # set per STT process
+stt_ready_barrier = None  # set per STT process
+
+# TTS (local) - Piper (piper-tts >= 1.3) runs in-process and works on any OS; without
+# it (or the voice model file) fall back to macOS 'say'. Loaded in main() so STT processes skip it.
+PIPER_VOICE_PATH = os.environ.get("PIPER_VOICE", "en_US-lessac-medium.onnx")
+piper_voice = None
+
+# AI (cloud) - the SDK's default async client (keep-alive pool, timeouts), using
+# HTTP/2 when the optional h2 package (httpx[http2]) is installed
+client = AsyncOpenAI(
+    api_key=os.environ.get("OPENAI_API_KEY"),
+    http_client=DefaultAsyncHttpxClient(http2=importlib.util.find_spec("h2") is not None),
+)
 
 SYSTEM_PROMPT = (
     "You are a helpful voice assistant for smart glasses. "
@@ -25,71 +69,323 @@ SYSTEM_PROMPT = (
     "unless you were provided updated info."
 )
 
-CHUNK_BYTES = 4096  # audio chunk size to send back (smaller chunks for better streaming)
+# Sentence boundaries in the streamed AI response; each sentence is spoken as soon as it ends
+SENTENCE_END = re.compile(r"(?<=[.!?])\s+")
+TURN_DONE = object()  # tts_q marker between replies
 
+# audio chunk size to send back (~0.28 s at 22050 Hz); the ESP32 WebSocketsClient
+# rejects frames over WEBSOCKETS_MAX_DATA_SIZE (15 KiB), so stay under that with the tag byte
+CHUNK_BYTES = 12288
+WRITE_LIMIT = 2**16  # websocket write buffer high-water mark before ws.send blocks
 
-def text_to_pcm_s16le_mono_22050(text: str) -> bytes:
+# Speech trimming (optional silero-vad); imported only in the server process, never by
+# the STT workers. Silero takes 512-sample windows at 16 kHz.
+HAVE_SILERO_VAD = importlib.util.find_spec("silero_vad") is not None
+VAD_WINDOW = 512
+VAD_WINDOW_BYTES = VAD_WINDOW * 2
+VAD_SILENCE_MS = 500  # a pause this long closes a speech segment (trim point only; E ends the utterance)
+MIN_SPEECH_MS = 250  # less detected speech than this is treated as a blip and dropped
+MIN_SPEECH_BYTES = 16000 * 2 * MIN_SPEECH_MS // 1000
+
+# Synthesized PCM by sentence text, least recently used first (~88 KB per second of speech)
+TTS_CACHE_SIZE = 256
+tts_cache = OrderedDict()
+tts_cache_hits = 0
+tts_cache_misses = 0
+
+
+async def _skip_to_wav_data(stream: asyncio.StreamReader):
     """
-    Uses macOS 'say' (free/offline) -> AIFF, then 'afconvert' -> WAV 16-bit mono 22050Hz.
-    Then extracts PCM frames from WAV.
-    Also saves a copy as response.wav for playback.
+    Consume a RIFF/WAVE header from a stream, stopping at the start of the 'data' chunk.
+    CoreAudio may emit extra chunks (e.g. FLLR padding), so walk chunks instead of
+    assuming a 44-byte header. The format is whatever we asked 'say' for, so 'fmt '
+    is skipped like any other chunk.
     """
-    aiff_path = "response.aiff"
-    wav_path = "response.wav"
+    riff = await stream.readexactly(12)
+    if riff[0:4] != b"RIFF" or riff[8:12] != b"WAVE":
+        raise ValueError("TTS output is not a WAV stream")
 
-    # 1) TTS -> AIFF
-    subprocess.check_call(["say", text, "-o", aiff_path])
+    while True:
+        chunk_id, size = struct.unpack("<4sI", await stream.readexactly(8))
+        if chunk_id == b"data":
+            return
+        await stream.readexactly(size + (size & 1))
 
-    # 2) Convert to WAV, 16-bit LE, mono, 22050Hz
-    subprocess.check_call([
-        "afconvert", aiff_path,
-        "-f", "WAVE",
-        "-d", f"LEI16@{SAMPLE_RATE}",
-        "-c", "1",
-        wav_path
-    ])
 
-    # 3) Read WAV PCM
-    with wave.open(wav_path, "rb") as wf:
-        assert wf.getnchannels() == 1
-        assert wf.getsampwidth() == 2
-        assert wf.getframerate() == SAMPLE_RATE
-        pcm = wf.readframes(wf.getnframes())
+async def say_pcm_stream(text: str):
+    """
+    Uses macOS 'say' (free/offline) to synthesize WAV 16-bit mono 22050Hz straight to a pipe,
+    and yields PCM in CHUNK_BYTES pieces as soon as they are produced.
+    """
+    proc = await asyncio.create_subprocess_exec(
+        "say", text,
+        "-o", "/dev/stdout",
+        "--file-format=WAVE",
+        f"--data-format=LEI16@{SAMPLE_RATE}",
+        stdout=asyncio.subprocess.PIPE,
+    )
 
-    # Clean up AIFF
-    os.remove(aiff_path)
+    try:
+        await _skip_to_wav_data(proc.stdout)
+
+        while True:
+            try:
+                chunk = await proc.stdout.readexactly(CHUNK_BYTES)
+            except asyncio.IncompleteReadError as e:
+                chunk = e.partial
+            if chunk:
+                yield chunk
+            if len(chunk) < CHUNK_BYTES:
+                break
+
+        if await proc.wait() != 0:
+            raise subprocess.CalledProcessError(proc.returncode, "say")
+    finally:
+        if proc.returncode is None:
+            proc.kill()
+            await proc.wait()
+
+
+def piper_pcm(text: str) -> bytes:
+    """Synthesize s16le mono PCM in-process with Piper (ONNX Runtime)"""
+    return b"".join(chunk.audio_int16_bytes for chunk in piper_voice.synthesize(text))
+
+
+async def synthesize_pcm_stream(text: str):
+    """Yields TTS PCM from Piper when a voice is loaded, falling back to macOS 'say' otherwise"""
+    if piper_voice is not None:
+        # Piper is CPU-bound; one sentence at a time keeps the executor hop short
+        loop = asyncio.get_running_loop()
+        pcm = memoryview(await loop.run_in_executor(None, piper_pcm, text))
+        for i in range(0, len(pcm), CHUNK_BYTES):
+            yield pcm[i:i+CHUNK_BYTES]
+    else:
+        async for chunk in say_pcm_stream(text):
+            yield chunk
+
+
+async def cached_pcm_stream(text: str):
+    """
+    Serve repeated sentences ("Sorry, I didn't catch that.") from an in-memory LRU
+    of synthesized PCM; on a miss, stream from the synthesizer and keep the result.
+    """
+    global tts_cache_hits, tts_cache_misses
+
+    pcm = tts_cache.get(text)
+    if pcm is not None:
+        tts_cache.move_to_end(text)
+        tts_cache_hits += 1
+        logger.info("🗂️ TTS cache hit (%d hits / %d misses)", tts_cache_hits, tts_cache_misses)
+        pcm = memoryview(pcm)
+        for i in range(0, len(pcm), CHUNK_BYTES):
+            yield pcm[i:i+CHUNK_BYTES]
+        return
+
+    tts_cache_misses += 1
+    logger.info("🗂️ TTS cache miss (%d hits / %d misses)", tts_cache_hits, tts_cache_misses)
+    chunks = []
+    async for chunk in synthesize_pcm_stream(text):
+        chunks.append(chunk)
+        yield chunk
+
+    tts_cache[text] = b"".join(chunks)
+    if len(tts_cache) > TTS_CACHE_SIZE:
+        tts_cache.popitem(last=False)
+
+
+async def text_to_pcm_stream(text: str):
+    """
+    Yields TTS PCM (16-bit mono 22050Hz) in CHUNK_BYTES pieces, cached or freshly synthesized.
+    With DEBUG set, also saves a copy as response.wav for playback (cache hits included).
+    """
+    if not DEBUG:
+        async for chunk in cached_pcm_stream(text):
+            yield chunk
+        return
 
-    print(f"💾 Saved TTS output: {wav_path}")
+    wav_path = "response.wav"
+    with wave.open(wav_path, "wb") as wf:
+        wf.setnchannels(1)
+        wf.setsampwidth(2)
+        wf.setframerate(SAMPLE_RATE)
+        async for chunk in cached_pcm_stream(text):
+            wf.writeframes(chunk)
+            yield chunk
 
-    return pcm
+    logger.debug("💾 Saved TTS output: %s", wav_path)
 
 
-async def send_audio_to_client(ws, pcm: bytes):
-    """Send audio chunks to ESP32 with detailed logging"""
-    total_bytes = len(pcm)
-    print(f"📊 Total audio size: {total_bytes} bytes ({total_bytes / (SAMPLE_RATE * 2):.2f} seconds)")
+async def send_audio_to_client(ws, chunks):
+    """
+    Send audio chunks to ESP32 as they are produced, with detailed logging.
+    No pacing sleep: ws.send waits once the write buffer passes WRITE_LIMIT,
+    so a slow ESP32 throttles us through TCP backpressure.
+    Chunks may be memoryviews; each is copied once into a reused tagged frame
+    buffer instead of allocating b"A" + chunk (websockets copies the frame on send).
+    """
+    frame = bytearray(1 + CHUNK_BYTES)
+    frame[0:1] = b"A"
+    frame_view = memoryview(frame)
 
+    total_bytes = 0
     chunk_count = 0
-    for i in range(0, len(pcm), CHUNK_BYTES):
-        chunk = pcm[i:i+CHUNK_BYTES]
-        msg = b"A" + chunk
-        await ws.send(msg)
-        chunk_count += 1
+    try:
+        async for chunk in chunks:
+            n = len(chunk)
+            frame_view[1:1+n] = chunk
+            await ws.send(frame_view[:1+n])
+            total_bytes += n
+            chunk_count += 1
+
+            # Log progress every 10 chunks
+            if chunk_count % 10 == 0:
+                logger.debug("📤 Sent chunk %d (%d bytes so far)", chunk_count, total_bytes)
+    except websockets.exceptions.ConnectionClosed:
+        raise
+    except Exception:
+        # Synthesis failed mid-stream; close off what the ESP32 already has so the
+        # partial audio plays on its own instead of merging into the next sentence
+        if chunk_count:
+            await ws.send(b"E")
+        raise
 
-        # Log progress every 10 chunks
-        if chunk_count % 10 == 0:
-            progress = (i / total_bytes) * 100
-            print(f"📤 Sent chunk {chunk_count} ({progress:.1f}% complete)")
+    await ws.send(b"E")  # End marker
+    logger.info("📊 Total audio size: %d bytes (%.2f seconds)", total_bytes, total_bytes / (SAMPLE_RATE * 2))
+    logger.info("✅ Sent %d audio chunks + END marker", chunk_count)
+
+
+if njit is not None:
+    @njit(parallel=True, fastmath=True, cache=True)
+    def i16_to_f32(src, dst):
+        """Cast and scale s16 samples to [-1, 1) float32 in one fused, vectorized pass"""
+        for i in prange(src.size):
+            dst[i] = src[i] * np.float32(1.0 / 32768.0)
+else:
+    def i16_to_f32(src, dst):
+        """Cast and scale s16 samples to [-1, 1) float32 in a single numpy pass"""
+        np.multiply(src, np.float32(1 / 32768.0), out=dst, casting="unsafe")
+
+
+def init_stt_process(ready_barrier):
+    """ProcessPoolExecutor initializer: load this worker's Whisper model once"""
+    global whisper, stt_ready_barrier
+    stt_ready_barrier = ready_barrier
+    whisper = WhisperModel(
+        WHISPER_MODEL,
+        device=WHISPER_DEVICE,
+        compute_type=WHISPER_COMPUTE,
+        cpu_threads=max(1, (os.cpu_count() or 1) // STT_PROCESSES),
+        num_workers=1,
+    )
+
+    # The first transcribe allocates CTranslate2's buffers; pay for that now with
+    # 1 s of silence (no VAD, which would skip decoding) instead of on the first utterance
+    start = time.perf_counter()
+    segments, _info = whisper.transcribe(np.zeros(16000, dtype=np.float32), language="en", beam_size=1)
+    for _seg in segments:
+        pass
+    # ...then once through the real path, which JIT-compiles i16_to_f32 (with numba)
+    # and loads faster-whisper's lazily created VAD model
+    transcribe(bytearray(32000))
+    logger.info("🔥 Whisper warm-up (pid %d): %.2f s", os.getpid(), time.perf_counter() - start)
+
+
+def stt_process_ready() -> int:
+    # Block until every worker is inside this call; a worker runs one job at a time,
+    # so STT_PROCESSES checks can only pass once each has finished its initializer
+    stt_ready_barrier.wait()
+    return os.getpid()
+
+
+def transcribe(raw: bytearray) -> str:
+    """Run Whisper over 16 kHz s16le mono PCM and return the joined transcript."""
+    # Convert to float32 in one pass over a view of the receive buffer;
+    # faster-whisper takes a 16 kHz array directly, no WAV/FFmpeg round trip
+    samples = np.frombuffer(raw, dtype=np.int16)
+    audio = np.empty(samples.shape, dtype=np.float32)
+    i16_to_f32(samples, audio)
+
+    # segments is a lazy generator; consume it here so decoding stays off the event loop
+    segments, _info = whisper.transcribe(
+        audio,
+        language="en",
+        beam_size=1,
+        vad_filter=True,
+        condition_on_previous_text=False,
+        without_timestamps=True,
+    )
+    return "".join(seg.text for seg in segments).strip()
+
+
+async def stream_llm_sentences(user_text: str):
+    """Stream the AI response and yield it one sentence at a time as tokens arrive"""
+    stream = await client.responses.create(
+        model="gpt-4.1-mini",
+        input=[
+            {"role": "system", "content": SYSTEM_PROMPT},
+            {"role": "user", "content": user_text},
+        ],
+        stream=True,
+    )
+
+    buffer = ""
+    async for event in stream:
+        if event.type != "response.output_text.delta":
+            continue
+        buffer += event.delta
+        *sentences, buffer = SENTENCE_END.split(buffer)
+        for sentence in sentences:
+            if sentence.strip():
+                yield sentence.strip()
+
+    if buffer.strip():
+        yield buffer.strip()
+
+
+def new_vad_iterator():
+    """Per-connection streaming Silero VAD; the model carries recurrent state, so it is not shared"""
+    from silero_vad import VADIterator, load_silero_vad
+    return VADIterator(load_silero_vad(), sampling_rate=16000, min_silence_duration_ms=VAD_SILENCE_MS)
+
+
+def vad_scan(vad, pcm: bytes, window: np.ndarray) -> list:
+    """
+    Run whole VAD windows of s16le pcm through vad; returns its start/end events (sample offsets).
+    Each window is converted into the caller's preallocated float32 buffer, which the VAD
+    reads but does not keep.
+    """
+    import torch
 
-        await asyncio.sleep(0.01)  # Small delay to prevent overwhelming ESP32
+    samples = np.frombuffer(pcm, dtype=np.int16)
+    window_t = torch.from_numpy(window)
+    events = []
+    for i in range(0, len(samples) - VAD_WINDOW + 1, VAD_WINDOW):
+        i16_to_f32(samples[i:i + VAD_WINDOW], window)
+        event = vad(window_t)
+        if event:
+            events.append(event)
+    return events
 
-    await ws.send(b"E")  # End marker
-    print(f"✅ Sent {chunk_count} audio chunks + END marker")
 
+async def receive_utterances(ws, stt_q: asyncio.Queue):
+    """
+    Assemble A-tagged chunks into utterances and hand each one to the STT stage.
+    The device's E (push-to-talk release) always ends the utterance. With Silero VAD
+    available, incoming audio is scanned as it arrives (in the executor, off the event
+    loop); on E the leading/trailing silence is trimmed, and utterances with less than
+    MIN_SPEECH_MS of speech never reach Whisper.
+    """
+    audio_buf = bytearray()
+    chunk_count = 0
 
-async def handler(ws):
-    print("✅ ESP32 connected")
-    audio_chunks = []
+    loop = asyncio.get_running_loop()
+    vad = await loop.run_in_executor(None, new_vad_iterator) if HAVE_SILERO_VAD else None
+    vad_window = np.empty(VAD_WINDOW, dtype=np.float32)
+    vad_pos = 0  # bytes of audio_buf already run through VAD
+    speech_start = None  # byte offset of the first speech onset
+    speech_end = None  # byte offset where the last closed speech segment ends
+    segment_start = None  # byte offset of the currently open speech segment
+    voiced_bytes = 0
 
     try:
         async for msg in ws:
@@ -97,86 +393,220 @@ async def handler(ws):
                 continue
 
             tag = msg[0:1]
-            payload = msg[1:]
 
             if tag == b"A":
                 # Receiving audio from ESP32
-                audio_chunks.append(payload)
+                audio_buf += memoryview(msg)[1:]
+                chunk_count += 1
                 # Log incoming audio periodically
-                if len(audio_chunks) % 50 == 0:
-                    total_bytes = sum(len(c) for c in audio_chunks)
-                    print(f"🎤 Receiving audio... {len(audio_chunks)} chunks ({total_bytes} bytes)")
+                if chunk_count % 50 == 0:
+                    logger.debug("🎤 Receiving audio... %d chunks (%d bytes)", chunk_count, len(audio_buf))
+
+                if vad is None:
+                    continue
+
+                n = (len(audio_buf) - vad_pos) // VAD_WINDOW_BYTES * VAD_WINDOW_BYTES
+                if not n:
+                    continue
+                pcm = bytes(memoryview(audio_buf)[vad_pos:vad_pos + n])
+                vad_pos += n
+                for event in await loop.run_in_executor(None, vad_scan, vad, pcm, vad_window):
+                    if "start" in event:
+                        segment_start = event["start"] * 2
+                        if speech_start is None:
+                            speech_start = segment_start
+                    if "end" in event and segment_start is not None:
+                        speech_end = event["end"] * 2
+                        voiced_bytes += speech_end - segment_start
+                        segment_start = None
 
             elif tag == b"E":
-                # End of utterance - process speech
-                raw = b"".join(audio_chunks)
+                # End of utterance - hand the buffer itself to STT and start a fresh one,
+                # since the STT stage may still be reading it when the next chunks arrive
+                raw, audio_buf = audio_buf, bytearray()
+                chunk_count = 0
                 total_bytes = len(raw)
                 duration = total_bytes / (16000 * 2)
-                print(f"🎤 Received complete utterance: {total_bytes} bytes ({duration:.2f} seconds)")
-                audio_chunks.clear()
-
-                if len(raw) < 16000 * 2:
-                    print("⚠️ Too short, ignoring")
+                logger.info("🎤 Received complete utterance: %d bytes (%.2f seconds)", total_bytes, duration)
+
+                if vad is not None:
+                    if segment_start is not None:
+                        # Still talking at release: speech runs to the end of the buffer
+                        voiced_bytes += len(raw) - segment_start
+                        speech_end = len(raw)
+                    start, end, voiced = speech_start, speech_end, voiced_bytes
+                    vad.reset_states()
+                    vad_pos = 0
+                    speech_start = speech_end = segment_start = None
+                    voiced_bytes = 0
+
+                    if start is None or voiced < MIN_SPEECH_BYTES:
+                        logger.info("🔇 No speech detected, ignoring")
+                        continue
+                    raw = raw[start:end]
+                    logger.info("✂️ Trimmed to speech: %d bytes (%.2f seconds)", len(raw), len(raw) / (16000 * 2))
+                elif len(raw) < 16000 * 2:
+                    logger.warning("⚠️ Too short, ignoring")
                     continue
 
-                # Convert to float32 and save
-                pcm = np.frombuffer(raw, dtype=np.int16).astype(np.float32) / 32768.0
-                sf.write("utterance.wav", pcm, 16000)
-                print("🎧 Saved: utterance.wav")
-
-                # Transcribe
-                print("🧠 Transcribing...")
-                segments, _info = whisper.transcribe("utterance.wav", language="en")
-                user_text = "".join(seg.text for seg in segments).strip()
-
-                print("\n" + "="*50)
-                print("👤 USER SAID:")
-                print(user_text)
-                print("="*50 + "\n")
-
-                # Get AI response
-                print("🤖 Getting AI response...")
-                ai = client.responses.create(
-                    model="gpt-4.1-mini",
-                    input=[
-                        {"role": "system", "content": SYSTEM_PROMPT},
-                        {"role": "user", "content": user_text},
-                    ],
-                )
-                answer = ai.output_text.strip()
-
-                print("="*50)
-                print("🤖 AI RESPONSE:")
-                print(answer)
-                print("="*50 + "\n")
-
-                # Convert AI answer to speech
-                print("🔊 Converting text to speech...")
-                tts_pcm = text_to_pcm_s16le_mono_22050(answer)
-
-                # Send audio back to ESP32
-                print("📤 Sending audio to ESP32...")
-                await send_audio_to_client(ws, tts_pcm)
-                print("✅ Complete! Ready for next utterance.\n")
+                await stt_q.put(raw)
 
     except websockets.exceptions.ConnectionClosed:
-        print("❌ ESP32 disconnected")
-    except Exception as e:
-        print(f"❌ Error: {e}")
-        import traceback
-        traceback.print_exc()
+        pass
+    finally:
+        logger.info("❌ ESP32 disconnected")
+        await stt_q.put(None)
+
+
+async def stt_worker(stt_q: asyncio.Queue, llm_q: asyncio.Queue, stt_pool: ProcessPoolExecutor):
+    loop = asyncio.get_running_loop()
+    while (raw := await stt_q.get()) is not None:
+        try:
+            logger.info("🧠 Transcribing...")
+            user_text = await loop.run_in_executor(stt_pool, transcribe, raw)
+        except Exception as e:
+            logger.exception("❌ STT error: %s", e)
+            continue
+
+        if not user_text:
+            # vad_filter drops silence/noise, leaving nothing worth answering
+            logger.info("🔇 Empty transcription, ignoring")
+            continue
+
+        logger.info("\n%s\n👤 USER SAID:\n%s\n%s\n", "="*50, user_text, "="*50)
+
+        await llm_q.put(user_text)
+
+    await llm_q.put(None)
+
+
+async def llm_worker(llm_q: asyncio.Queue, tts_q: asyncio.Queue):
+    while (user_text := await llm_q.get()) is not None:
+        logger.info("🤖 Getting AI response...")
+        sentences = []
+        try:
+            # Hand each sentence to TTS as soon as it is complete
+            async for sentence in stream_llm_sentences(user_text):
+                sentences.append(sentence)
+                await tts_q.put(sentence)
+        except Exception as e:
+            logger.exception("❌ LLM error: %s", e)
+        await tts_q.put(TURN_DONE)
+
+        logger.info("%s\n🤖 AI RESPONSE:\n%s\n%s\n", "="*50, " ".join(sentences), "="*50)
+
+    await tts_q.put(None)
+
+
+async def tts_worker(ws, tts_q: asyncio.Queue):
+    while (sentence := await tts_q.get()) is not None:
+        if sentence is TURN_DONE:
+            logger.info("✅ Complete! Ready for next utterance.\n")
+            continue
+
+        try:
+            # Convert each sentence to speech and stream it back to ESP32 as it is synthesized
+            logger.info("🔊 Speaking: %s", sentence)
+            await send_audio_to_client(ws, text_to_pcm_stream(sentence))
+        except websockets.exceptions.ConnectionClosed:
+            raise
+        except Exception as e:
+            logger.exception("❌ TTS error: %s", e)
+
+
+def load_piper_voice():
+    if PiperVoice is None or not os.path.exists(PIPER_VOICE_PATH):
+        return None
+    try:
+        from piper import AudioChunk  # noqa: F401 - chunked synthesize() API, piper-tts >= 1.3
+    except ImportError:
+        logger.warning("⚠️ piper-tts >= 1.3 is required for in-process TTS; using 'say'")
+        return None
+    voice = PiperVoice.load(PIPER_VOICE_PATH)
+    if voice.config.sample_rate != SAMPLE_RATE:
+        logger.warning("⚠️ Piper voice is %d Hz, need %d Hz; using 'say'", voice.config.sample_rate, SAMPLE_RATE)
+        return None
+    return voice
+
+
+async def handler(ws, stt_pool: ProcessPoolExecutor):
+    """
+    Runs receive -> STT -> LLM -> TTS/send as separate tasks joined by queues,
+    so the next utterance can be transcribed while the previous reply is still
+    being synthesized and streamed. The reply reaches TTS sentence by sentence, and
+    each sentence goes out with its own END marker so the ESP32 starts playing early.
+    When the ESP32 disconnects (or any stage dies) the remaining stages are
+    cancelled, so queued utterances are not transcribed and answered for a dead socket.
+    """
+    logger.info("✅ ESP32 connected")
+
+    stt_q = asyncio.Queue()
+    llm_q = asyncio.Queue()
+    tts_q = asyncio.Queue()
+
+    tasks = [
+        asyncio.create_task(receive_utterances(ws, stt_q)),
+        asyncio.create_task(stt_worker(stt_q, llm_q, stt_pool)),
+        asyncio.create_task(llm_worker(llm_q, tts_q)),
+        asyncio.create_task(tts_worker(ws, tts_q)),
+    ]
+    try:
+        # The receiver returns on disconnect; the workers only return early by failing
+        await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        for task in tasks:
+            task.cancel()
+        results = await asyncio.gather(*tasks, return_exceptions=True)
+
+    for result in results:
+        if isinstance(result, websockets.exceptions.ConnectionClosed):
+            continue
+        if isinstance(result, Exception):
+            logger.error("❌ Error: %s", result, exc_info=result)
 
 
 async def main():
-    print("="*60)
-    print(f"🎙️  WebSocket Voice Assistant Server")
-    print(f"📡 Listening on ws://0.0.0.0:{PORT}")
-    print(f"🔊 TTS Sample Rate: {SAMPLE_RATE} Hz")
-    print(f"📦 Chunk Size: {CHUNK_BYTES} bytes")
-    print("="*60 + "\n")
-
-    async with websockets.serve(handler, "0.0.0.0", PORT, max_size=20_000_000):
-        await asyncio.Future()
+    global piper_voice
+    piper_voice = load_piper_voice()
+    if HAVE_SILERO_VAD:
+        import torch
+        torch.set_num_threads(1)  # VAD windows are tiny; extra threads only add overhead
+    tts_engine = f"Piper ({PIPER_VOICE_PATH})" if piper_voice is not None else "macOS say"
+
+    logger.info("="*60)
+    logger.info("🎙️  WebSocket Voice Assistant Server")
+    logger.info("📡 Listening on ws://0.0.0.0:%d", PORT)
+    logger.info("🧠 Whisper Model: %s (%s, %d processes)", WHISPER_MODEL, WHISPER_DEVICE, STT_PROCESSES)
+    logger.info("🔊 TTS: %s @ %d Hz", tts_engine, SAMPLE_RATE)
+    logger.info("🗣️ Speech trimming VAD: %s", "silero" if HAVE_SILERO_VAD else "off")
+    logger.info("📦 Chunk Size: %d bytes", CHUNK_BYTES)
+    logger.info("="*60 + "\n")
+
+    # spawn, not fork: the CUDA probe above may already have initialized the driver here
+    mp_context = multiprocessing.get_context("spawn")
+    stt_pool = ProcessPoolExecutor(
+        max_workers=STT_PROCESSES,
+        mp_context=mp_context,
+        initializer=init_stt_process,
+        initargs=(mp_context.Barrier(STT_PROCESSES),),
+    )
+    with stt_pool:
+        # Workers start lazily; one ready-check per worker spawns them all, and the
+        # barrier holds each check until every model is loaded and warmed, before
+        # the first ESP32 connects
+        loop = asyncio.get_running_loop()
+        await asyncio.gather(*(
+            loop.run_in_executor(stt_pool, stt_process_ready) for _ in range(STT_PROCESSES)
+        ))
+
+        # Raw PCM barely compresses, so permessage-deflate would only burn CPU on both ends
+        async with websockets.serve(
+            functools.partial(handler, stt_pool=stt_pool), "0.0.0.0", PORT,
+            max_size=20_000_000,
+            write_limit=WRITE_LIMIT,
+            compression=None,
+        ):
+            await asyncio.Future()
 
 
 if __name__ == "__main__":